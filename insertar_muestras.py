@@ -5,12 +5,163 @@ Crea tablas separadas para Banco Móvil y Banco Virtual
 """
 
 import pandas as pd
-from sqlalchemy import create_engine, text
-import psycopg2
+from sqlalchemy import create_engine, text, inspect
+from sqlalchemy.engine import URL
 import logging
 from datetime import datetime
 import os
+import io
+import csv
 from pathlib import Path
+from concurrent.futures import ThreadPoolExecutor
+
+# Motor de lectura Excel: calamine (Rust) si está instalado y pandas lo soporta
+# (engine='calamine' existe desde pandas 2.2); si no, el de pandas por defecto
+try:
+    import python_calamine  # noqa: F401
+    PANDAS_VERSION = tuple(int(part) for part in pd.__version__.split('.')[:2])
+    EXCEL_ENGINE = 'calamine' if PANDAS_VERSION >= (2, 2) else None
+except ImportError:
+    EXCEL_ENGINE = None
+
+# ===========================================
+# SENTENCIAS SQL (se compilan una sola vez)
+# ===========================================
+
+VERSION_SQL = text("SELECT version()")
+
+# Tabla para Banco Móvil
+BM_TABLE_SQL = text("""
+CREATE TABLE IF NOT EXISTS banco_movil_clean (
+    id SERIAL PRIMARY KEY,
+    timestamp TIMESTAMP,
+    customer_id TEXT,
+    channel TEXT,
+    nps_recomendacion_score INTEGER,
+    nps_recomendacion_motivo TEXT,
+    csat_satisfaccion_score INTEGER,
+    csat_satisfaccion_motivo TEXT,
+    nps_score_original INTEGER,
+    nps_score INTEGER,
+    nps_category TEXT,
+    cleaned_date TIMESTAMP,
+    file_type TEXT,
+    month_year TEXT,
+    processed_date TIMESTAMP DEFAULT NOW()
+);
+""")
+
+# Tabla para Banco Virtual
+BV_TABLE_SQL = text("""
+CREATE TABLE IF NOT EXISTS banco_virtual_clean (
+    id SERIAL PRIMARY KEY,
+    date_submitted_original TIMESTAMP,
+    date_submitted TIMESTAMP,
+    country TEXT,
+    source_url TEXT,
+    device TEXT,
+    browser TEXT,
+    operating_system TEXT,
+    nps_score_bv INTEGER,
+    nps_score INTEGER,
+    nps_category TEXT,
+    calificacion_acerca TEXT,
+    motivo_calificacion TEXT,
+    tags_nps TEXT,
+    tags_calificacion TEXT,
+    tags_motivo TEXT,
+    sentiment_motivo TEXT,
+    cleaned_date TIMESTAMP,
+    file_type TEXT,
+    month_year TEXT,
+    processed_date TIMESTAMP DEFAULT NOW()
+);
+""")
+
+COUNTS_SQL = text("""
+SELECT (SELECT COUNT(*) FROM banco_movil_clean),
+       (SELECT COUNT(*) FROM banco_virtual_clean)
+""")
+
+# Ejemplos de ambas tablas en una sola consulta (columnas a texto para el UNION)
+SAMPLES_SQL = text("""
+(SELECT 'BM' AS origen, nps_score::text, nps_category::text, nps_recomendacion_score::text
+ FROM banco_movil_clean
+ WHERE nps_score IS NOT NULL
+ LIMIT 3)
+UNION ALL
+(SELECT 'BV' AS origen, nps_score::text, device::text, country::text
+ FROM banco_virtual_clean
+ WHERE nps_score IS NOT NULL
+ LIMIT 3)
+""")
+
+# Ajustes solo para la transacción de índices: más memoria para ordenar, sin esperar
+# el flush del WAL en el commit y sin los NOTICE de "ya existe"
+INDEX_SESSION_SQL = text("""
+SET LOCAL maintenance_work_mem = '512MB';
+SET LOCAL synchronous_commit = off;
+SET LOCAL client_min_messages = warning;
+""")
+
+# Todos los índices en un solo envío al servidor
+INDEXES_SQL = text("""
+CREATE INDEX IF NOT EXISTS idx_bm_nps_score ON banco_movil_clean(nps_score);
+-- Cubriente: los conteos/promedios por categoría se resuelven solo con el índice.
+-- Reemplaza a idx_bm_category, que en bases ya creadas quedaría duplicado
+DROP INDEX IF EXISTS idx_bm_category;
+CREATE INDEX IF NOT EXISTS idx_bm_category_score ON banco_movil_clean(nps_category) INCLUDE (nps_score);
+CREATE INDEX IF NOT EXISTS idx_bm_month ON banco_movil_clean(month_year);
+-- BRIN: cleaned_date crece con cada carga, así que un índice de rangos ocupa unos pocos KB
+CREATE INDEX IF NOT EXISTS idx_bm_cleaned_date_brin ON banco_movil_clean USING BRIN (cleaned_date) WITH (pages_per_range = 32);
+CREATE INDEX IF NOT EXISTS idx_bv_nps_score ON banco_virtual_clean(nps_score);
+CREATE INDEX IF NOT EXISTS idx_bv_device ON banco_virtual_clean(device);
+CREATE INDEX IF NOT EXISTS idx_bv_country ON banco_virtual_clean(country);
+""")
+
+# Parciales: solo respuestas con motivo escrito, para los análisis de texto.
+# to_sql crea cada columna de motivo solo si aparece en las respuestas, así que
+# cada índice se crea únicamente cuando su columna existe
+MOTIVO_INDEXES_SQL = {
+    'nps_recomendacion_motivo': text("""
+CREATE INDEX IF NOT EXISTS idx_bm_nps_motivo ON banco_movil_clean(month_year)
+    WHERE nps_recomendacion_motivo IS NOT NULL AND length(trim(nps_recomendacion_motivo)) > 0;
+"""),
+    'csat_satisfaccion_motivo': text("""
+CREATE INDEX IF NOT EXISTS idx_bm_csat_motivo ON banco_movil_clean(month_year)
+    WHERE csat_satisfaccion_motivo IS NOT NULL AND length(trim(csat_satisfaccion_motivo)) > 0;
+""")
+}
+
+# Palabras que identifican columnas de feedback en BV (nombres largos de Hotjar);
+# se buscan como substring del nombre, así que basta con recorrerlas
+FEEDBACK_KEYWORDS = ('calificación', 'motivo', 'tags', 'sentiment')
+
+# Marcador de nulos para COPY (permite distinguir NULL de texto vacío)
+COPY_NULL = '\\N'
+
+def copy_value(value):
+    """Adapta un valor de pandas al formato CSV que espera COPY"""
+    if value is None:
+        return COPY_NULL
+    # COPY no acepta '9.0' en columnas INTEGER
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+def copy_insert(table, conn, keys, data_iter):
+    """Método de inserción para to_sql usando COPY FROM STDIN de PostgreSQL"""
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerows([copy_value(value) for value in row] for row in data_iter)
+    buffer.seek(0)
+    
+    columns = ', '.join('"{}"'.format(k.replace('"', '""')) for k in keys)
+    table_name = f'"{table.schema}"."{table.name}"' if table.schema else f'"{table.name}"'
+    copy_sql = f"COPY {table_name} ({columns}) FROM STDIN WITH (FORMAT csv, NULL '{COPY_NULL}')"
+    
+    with conn.connection.cursor() as cursor:
+        cursor.copy_expert(copy_sql, buffer)
 
 class NPSInserter:
     """Clase para insertar datos NPS limpios en PostgreSQL"""
@@ -42,49 +193,44 @@ class NPSInserter:
     def connect_database(self):
         """Establece conexión con PostgreSQL"""
         try:
-            # Primero prueba conexión básica con parámetros de encoding
-            conn = psycopg2.connect(
+            # Crea engine SQLAlchemy con parámetros adicionales
+            # URL.create escapa usuario y password (caracteres como @, : o /)
+            connection_string = URL.create(
+                'postgresql',
+                username=self.db_config['username'],
+                password=self.db_config['password'],
                 host=self.db_config['host'],
-                port=self.db_config['port'],
+                port=int(self.db_config['port']),
                 database=self.db_config['database'],
-                user=self.db_config['username'],
-                password=self.db_config['password'],
-                client_encoding='utf8'
-            )
-            conn.close()
-            self.logger.info("Conexión PostgreSQL exitosa")
-            
-            # Crea engine SQLAlchemy con parámetros adicionales
-            connection_string = (
-                f"postgresql://{self.db_config['username']}:"
-                f"{self.db_config['password']}@{self.db_config['host']}:"
-                f"{self.db_config['port']}/{self.db_config['database']}"
-                f"?client_encoding=utf8"
+                query={'client_encoding': 'utf8'}
             )
             
             self.engine = create_engine(
                 connection_string,
-                pool_size=5,
-                max_overflow=10,
-                pool_pre_ping=True,
-                connect_args={"client_encoding": "utf8"}
+                # Script de una sola ejecución: BM y BV en paralelo necesitan solo dos
+                # conexiones, que se reutilizan (sin ping de verificación en cada checkout)
+                pool_size=2,
+                max_overflow=2,
+                pool_pre_ping=False,
+                connect_args={"client_encoding": "utf8", "application_name": "insertar_muestras"}
             )
             
-            # Test del engine con mejor manejo de errores
+            # Test del engine: una sola conexión valida credenciales y encoding
             try:
                 with self.engine.connect() as conn:
-                    result = conn.execute(text("SELECT version()"))
+                    result = conn.execute(VERSION_SQL)
                     version = result.fetchone()[0]
-                    self.logger.info(f"Engine conectado: {version[:50]}...")
+                    self.logger.info("Conexión PostgreSQL exitosa")
+                    self.logger.info("Engine conectado: %s...", version[:50])
             except Exception as e:
-                self.logger.error(f"Error testing engine: {str(e)}")
+                self.logger.error("Error testing engine: %s", e)
                 self.engine = None
                 return False
             
             return True
             
         except Exception as e:
-            self.logger.error(f"Error conectando a PostgreSQL: {str(e)}")
+            self.logger.error("Error conectando a PostgreSQL: %s", e)
             return False
     
     def create_tables_if_needed(self):
@@ -94,65 +240,16 @@ class NPSInserter:
             return False
             
         try:
-            with self.engine.connect() as conn:
-                # Tabla para Banco Móvil
-                bm_table_sql = """
-                CREATE TABLE IF NOT EXISTS banco_movil_clean (
-                    id SERIAL PRIMARY KEY,
-                    timestamp TIMESTAMP,
-                    customer_id VARCHAR(100),
-                    channel VARCHAR(50),
-                    nps_recomendacion_score INTEGER,
-                    nps_recomendacion_motivo TEXT,
-                    csat_satisfaccion_score INTEGER,
-                    csat_satisfaccion_motivo TEXT,
-                    nps_score_original INTEGER,
-                    nps_score INTEGER,
-                    nps_category VARCHAR(20),
-                    cleaned_date TIMESTAMP,
-                    file_type VARCHAR(10),
-                    month_year VARCHAR(7),
-                    processed_date TIMESTAMP DEFAULT NOW()
-                );
-                """
-                
-                # Tabla para Banco Virtual  
-                bv_table_sql = """
-                CREATE TABLE IF NOT EXISTS banco_virtual_clean (
-                    id SERIAL PRIMARY KEY,
-                    date_submitted_original TIMESTAMP,
-                    date_submitted TIMESTAMP,
-                    country VARCHAR(50),
-                    source_url TEXT,
-                    device VARCHAR(50),
-                    browser VARCHAR(100),
-                    operating_system VARCHAR(100),
-                    nps_score_bv INTEGER,
-                    nps_score INTEGER,
-                    nps_category VARCHAR(20),
-                    calificacion_acerca TEXT,
-                    motivo_calificacion TEXT,
-                    tags_nps TEXT,
-                    tags_calificacion TEXT,
-                    tags_motivo TEXT,
-                    sentiment_motivo VARCHAR(20),
-                    cleaned_date TIMESTAMP,
-                    file_type VARCHAR(10),
-                    month_year VARCHAR(7),
-                    processed_date TIMESTAMP DEFAULT NOW()
-                );
-                """
-                
+            with self.engine.begin() as conn:
                 # Ejecuta creación de tablas
-                conn.execute(text(bm_table_sql))
-                conn.execute(text(bv_table_sql))
-                conn.commit()
+                conn.execute(BM_TABLE_SQL)
+                conn.execute(BV_TABLE_SQL)
                 
                 self.logger.info("Tablas creadas/verificadas exitosamente")
                 return True
                 
         except Exception as e:
-            self.logger.error(f"Error creando tablas: {str(e)}")
+            self.logger.error("Error creando tablas: %s", e)
             return False
     
     def insert_banco_movil(self, file_path):
@@ -162,14 +259,14 @@ class NPSInserter:
             return False
             
         try:
-            self.logger.info(f"Insertando Banco Móvil desde: {file_path}")
+            self.logger.info("Insertando Banco Móvil desde: %s", file_path)
             
             # Lee archivo
-            df = pd.read_excel(file_path)
+            df = pd.read_excel(file_path, engine=EXCEL_ENGINE)
             original_count = len(df)
             
             # Log de columnas disponibles
-            self.logger.info(f"Columnas en BM: {list(df.columns)}")
+            self.logger.info("Columnas en BM: %s", list(df.columns))
             
             # FILTRAR SOLO COLUMNAS RELEVANTES PARA LA TABLA
             columns_to_keep = [
@@ -181,12 +278,10 @@ class NPSInserter:
             
             # Filtrar solo columnas que existen
             available_columns = [col for col in columns_to_keep if col in df.columns]
-            df_filtered = df[available_columns].copy()
-            
-            self.logger.info(f"Columnas filtradas para inserción: {available_columns}")
+            self.logger.info("Columnas filtradas para inserción: %s", available_columns)
             
-            # Limpia datos antes de insertar
-            df_filtered = df_filtered.dropna(how='all')  # Remueve filas completamente vacías
+            # Limpia datos antes de insertar (dropna ya devuelve un DataFrame nuevo)
+            df_filtered = df[available_columns].dropna(how='all')  # Remueve filas completamente vacías
             
             # Convierte fechas
             if 'timestamp' in df_filtered.columns:
@@ -200,18 +295,17 @@ class NPSInserter:
                 self.engine, 
                 if_exists='append',
                 index=False,
-                method='multi',
-                chunksize=1000
+                method=copy_insert,
+                chunksize=10000
             )
             
             self.stats['bm_inserted'] = len(df_filtered)
-            self.logger.info(f"Banco Móvil insertado: {len(df_filtered)} registros (original: {original_count})")
+            self.logger.info("Banco Móvil insertado: %d registros (original: %d)", len(df_filtered), original_count)
             
             return True
             
         except Exception as e:
-            self.logger.error(f"Error insertando Banco Móvil: {str(e)}")
-            self.stats['errors'] += 1
+            self.logger.error("Error insertando Banco Móvil: %s", e)
             return False
     
     def insert_banco_virtual(self, file_path):
@@ -221,14 +315,14 @@ class NPSInserter:
             return False
             
         try:
-            self.logger.info(f"Insertando Banco Virtual desde: {file_path}")
+            self.logger.info("Insertando Banco Virtual desde: %s", file_path)
             
             # Lee archivo
-            df = pd.read_excel(file_path)
+            df = pd.read_excel(file_path, engine=EXCEL_ENGINE)
             original_count = len(df)
             
             # Log de columnas disponibles
-            self.logger.info(f"Columnas en BV: {list(df.columns)}")
+            self.logger.info("Columnas en BV: %s", list(df.columns))
             
             # FILTRAR SOLO COLUMNAS RELEVANTES PARA LA TABLA
             columns_to_keep = [
@@ -237,17 +331,20 @@ class NPSInserter:
             ]
             
             # Agregar columnas de feedback si existen (con nombres largos)
-            feedback_cols = [col for col in df.columns if 'calificación' in col.lower() or 'motivo' in col.lower() or 'tags' in col.lower() or 'sentiment' in col.lower()]
+            feedback_cols = []
+            for col in df.columns:
+                col_lower = col.lower()
+                if any(keyword in col_lower for keyword in FEEDBACK_KEYWORDS):
+                    feedback_cols.append(col)
             columns_to_keep.extend(feedback_cols)
             
             # Filtrar solo columnas que existen
-            available_columns = [col for col in columns_to_keep if col in df.columns]
-            df_filtered = df[available_columns].copy()
-            
-            self.logger.info(f"Columnas filtradas para inserción: {available_columns}")
+            existing_columns = set(df.columns)
+            available_columns = [col for col in columns_to_keep if col in existing_columns]
+            self.logger.info("Columnas filtradas para inserción: %s", available_columns)
             
-            # Limpia datos antes de insertar
-            df_filtered = df_filtered.dropna(how='all')
+            # Limpia datos antes de insertar (dropna ya devuelve un DataFrame nuevo)
+            df_filtered = df[available_columns].dropna(how='all')
             
             # Convierte fechas
             if 'date_submitted' in df_filtered.columns:
@@ -261,84 +358,64 @@ class NPSInserter:
                 self.engine,
                 if_exists='replace',  # Cambiado a replace para que cree tabla con columnas correctas 
                 index=False,
-                method='multi',
-                chunksize=1000
+                method=copy_insert,
+                chunksize=10000
             )
             
             self.stats['bv_inserted'] = len(df_filtered)
-            self.logger.info(f"Banco Virtual insertado: {len(df_filtered)} registros (original: {original_count})")
+            self.logger.info("Banco Virtual insertado: %d registros (original: %d)", len(df_filtered), original_count)
             
             return True
             
         except Exception as e:
-            self.logger.error(f"Error insertando Banco Virtual: {str(e)}")
-            self.stats['errors'] += 1
+            self.logger.error("Error insertando Banco Virtual: %s", e)
             return False
     
     def verify_data(self):
         """Verifica los datos insertados"""
         try:
             with self.engine.connect() as conn:
-                # Verifica Banco Móvil
-                bm_result = conn.execute(text("SELECT COUNT(*) FROM banco_movil_clean"))
-                bm_count = bm_result.fetchone()[0]
+                # Verifica Banco Móvil y Banco Virtual en una sola consulta
+                counts_result = conn.execute(COUNTS_SQL)
+                bm_count, bv_count = counts_result.fetchone()
                 
-                # Verifica Banco Virtual
-                bv_result = conn.execute(text("SELECT COUNT(*) FROM banco_virtual_clean"))
-                bv_count = bv_result.fetchone()[0]
-                
-                self.logger.info(f"Verificación - BM: {bm_count} registros, BV: {bv_count} registros")
+                self.logger.info("Verificación - BM: %s registros, BV: %s registros", bm_count, bv_count)
                 
                 # Muestra ejemplos de datos
-                bm_sample = conn.execute(text("""
-                    SELECT nps_score, nps_category, nps_recomendacion_score 
-                    FROM banco_movil_clean 
-                    WHERE nps_score IS NOT NULL 
-                    LIMIT 3
-                """))
+                samples = conn.execute(SAMPLES_SQL).fetchall()
                 
                 self.logger.info("Muestra BM:")
-                for row in bm_sample:
-                    self.logger.info(f"  NPS: {row[0]}, Categoría: {row[1]}, Recomendación: {row[2]}")
-                
-                bv_sample = conn.execute(text("""
-                    SELECT nps_score, device, country 
-                    FROM banco_virtual_clean 
-                    WHERE nps_score IS NOT NULL 
-                    LIMIT 3
-                """))
+                for row in samples:
+                    if row[0] == 'BM':
+                        self.logger.info("  NPS: %s, Categoría: %s, Recomendación: %s", row[1], row[2], row[3])
                 
                 self.logger.info("Muestra BV:")
-                for row in bv_sample:
-                    self.logger.info(f"  NPS: {row[0]}, Dispositivo: {row[1]}, País: {row[2]}")
+                for row in samples:
+                    if row[0] == 'BV':
+                        self.logger.info("  NPS: %s, Dispositivo: %s, País: %s", row[1], row[2], row[3])
                 
                 return True
                 
         except Exception as e:
-            self.logger.error(f"Error verificando datos: {str(e)}")
+            self.logger.error("Error verificando datos: %s", e)
             return False
     
     def create_indexes(self):
         """Crea índices para optimizar queries"""
         try:
-            with self.engine.connect() as conn:
-                indexes = [
-                    "CREATE INDEX IF NOT EXISTS idx_bm_nps_score ON banco_movil_clean(nps_score);",
-                    "CREATE INDEX IF NOT EXISTS idx_bm_category ON banco_movil_clean(nps_category);", 
-                    "CREATE INDEX IF NOT EXISTS idx_bm_month ON banco_movil_clean(month_year);",
-                    "CREATE INDEX IF NOT EXISTS idx_bv_nps_score ON banco_virtual_clean(nps_score);",
-                    "CREATE INDEX IF NOT EXISTS idx_bv_device ON banco_virtual_clean(device);",
-                    "CREATE INDEX IF NOT EXISTS idx_bv_country ON banco_virtual_clean(country);"
-                ]
+            with self.engine.begin() as conn:
+                conn.execute(INDEX_SESSION_SQL)
+                conn.execute(INDEXES_SQL)
                 
-                for index_sql in indexes:
-                    conn.execute(text(index_sql))
+                bm_columns = {col['name'] for col in inspect(conn).get_columns('banco_movil_clean')}
+                for column, index_sql in MOTIVO_INDEXES_SQL.items():
+                    if column in bm_columns:
+                        conn.execute(index_sql)
                 
-                conn.commit()
                 self.logger.info("Índices creados exitosamente")
                 
         except Exception as e:
-            self.logger.error(f"Error creando índices: {str(e)}")
+            self.logger.error("Error creando índices: %s", e)
     
     def print_summary(self):
         """Imprime resumen final"""
@@ -348,11 +425,11 @@ class NPSInserter:
         self.logger.info("=" * 50)
         self.logger.info("RESUMEN DE INSERCIÓN")
         self.logger.info("=" * 50)
-        self.logger.info(f"Banco Móvil insertado: {self.stats['bm_inserted']} registros")
-        self.logger.info(f"Banco Virtual insertado: {self.stats['bv_inserted']} registros")
-        self.logger.info(f"Total insertado: {self.stats['bm_inserted'] + self.stats['bv_inserted']} registros")
-        self.logger.info(f"Errores: {self.stats['errors']}")
-        self.logger.info(f"Tiempo total: {duration}")
+        self.logger.info("Banco Móvil insertado: %s registros", self.stats['bm_inserted'])
+        self.logger.info("Banco Virtual insertado: %s registros", self.stats['bv_inserted'])
+        self.logger.info("Total insertado: %s registros", self.stats['bm_inserted'] + self.stats['bv_inserted'])
+        self.logger.info("Errores: %s", self.stats['errors'])
+        self.logger.info("Tiempo total: %s", duration)
         self.logger.info("=" * 50)
         
         if self.stats['errors'] == 0:
@@ -396,9 +473,15 @@ def main():
             print("ERROR: No se pudo conectar a PostgreSQL")
             return
         
-        # Inserta datos (las tablas se crean automáticamente)
-        success_bm = inserter.insert_banco_movil(files['bm'])
-        success_bv = inserter.insert_banco_virtual(files['bv'])
+        # Inserta datos (las tablas se crean automáticamente); BM y BV usan
+        # archivos, tablas y conexiones distintas, así que van en paralelo
+        with ThreadPoolExecutor(max_workers=2) as executor:
+            future_bm = executor.submit(inserter.insert_banco_movil, files['bm'])
+            future_bv = executor.submit(inserter.insert_banco_virtual, files['bv'])
+            success_bm = future_bm.result()
+            success_bv = future_bv.result()
+        # Los errores se cuentan aquí y no en cada hilo (+= sobre stats no es atómico)
+        inserter.stats['errors'] += [success_bm, success_bv].count(False)
         
         if success_bm and success_bv:
             # Verifica inserción
@@ -414,7 +497,7 @@ def main():
             print("ERROR: Falló la inserción de algunos archivos")
     
     except Exception as e:
-        inserter.logger.error(f"Error en proceso principal: {str(e)}")
+        inserter.logger.error("Error en proceso principal: %s", e)
         
     finally:
         if inserter.engine:
@@ -12,13 +12,70 @@ import logging
 from datetime import datetime
 import os
 from pathlib import Path
+from concurrent.futures import ProcessPoolExecutor
 import numpy as np
 
+# orjson (extensión en C) es bastante más rápido; si no está instalado se usa json.
+# orjson es más estricto (NaN, Infinity, enteros de más de 64 bits), así que lo que
+# rechace se reintenta con json para aceptar lo mismo que antes
+try:
+    import orjson
+
+    def json_loads(text):
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            return json.loads(text)
+except ImportError:
+    json_loads = json.loads
+
+# Motor de lectura Excel: calamine (Rust) si está instalado y pandas lo soporta
+# (engine='calamine' existe desde pandas 2.2); si no, el de pandas por defecto
+try:
+    import python_calamine  # noqa: F401
+    PANDAS_VERSION = tuple(int(part) for part in pd.__version__.split('.')[:2])
+    EXCEL_ENGINE = 'calamine' if PANDAS_VERSION >= (2, 2) else None
+except ImportError:
+    EXCEL_ENGINE = None
+
+# pyarrow para leer la copia Parquet de las muestras; sin él se lee el Excel
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
+
+# Mapeo de subQuestionId de BM a columnas de salida
+SUBQUESTION_COLUMNS = {
+    'nps_rate_recomendation': 'nps_recomendacion_score',
+    'nps_text_recomendation': 'nps_recomendacion_motivo',
+    'csat_rate_satisfied': 'csat_satisfaccion_score',
+    'csat_text_satisfied': 'csat_satisfaccion_motivo'
+}
+
+# Reparación de JSON con comillas simples (propiedades y valores)
+JSON_SINGLE_QUOTED_KEY = re.compile(r"'(\w+)':")
+JSON_SINGLE_QUOTED_VALUE = re.compile(r":\s*'([^']*?)'")
+
+# Caracteres permitidos en comentarios de feedback (mantiene tildes y ñ)
+FEEDBACK_INVALID_CHARS = re.compile(r'[^\w\s\.\,\!\?\:\;\-\ñáéíóúÁÉÍÓÚ]')
+
+# Tipo de archivo (BM/BV) al inicio de una palabra del nombre: cubre tanto
+# 'agosto_bm_2025_muestra_N.xlsx' como 'bmagosto_muestra_N.xlsx'
+FILE_TYPE_PATTERN = re.compile(r'(?<![a-z])(bm|bv)')
+
+# A partir de este tamaño el JSON de answers se parsea en varios procesos
+PARALLEL_MIN_ROWS = 20000
+
 class SampleCleaner:
     """Limpiador especializado para muestras de datos NPS"""
     
-    def __init__(self):
-        self.setup_logging()
+    def __init__(self, configure_logging=True):
+        # Los procesos hijo no configuran handlers propios sobre sample_cleaning.log
+        if configure_logging:
+            self.setup_logging()
+        else:
+            self.logger = logging.getLogger(__name__)
         self.stats = {
             'bm_processed': 0,
             'bv_processed': 0,
@@ -47,6 +104,10 @@ class SampleCleaner:
             'Â¡': '¡', 
             'Â': ''
         }
+        
+        # Un solo patrón con todas las secuencias, en el orden del mapeo, para
+        # corregir el texto en una pasada conservando la prioridad de reemplazo
+        self.encoding_pattern = re.compile('|'.join(re.escape(wrong) for wrong in self.encoding_fixes))
     
     def setup_logging(self):
         """Configura logging"""
@@ -65,13 +126,28 @@ class SampleCleaner:
         if not isinstance(text, str) or pd.isna(text):
             return text
         
-        fixed_text = text
-        for wrong, right in self.encoding_fixes.items():
-            if wrong in fixed_text:
-                fixed_text = fixed_text.replace(wrong, right)
-                self.stats['encoding_fixed'] += 1
+        # Todos los patrones mal codificados contienen 'Ã' o 'Â'; el texto
+        # limpio (la gran mayoría) sale sin recorrer el mapeo
+        if 'Ã' not in text and 'Â' not in text:
+            return text
+        
+        found = set(self.encoding_pattern.findall(text))
+        if not found:
+            return text
         
-        return fixed_text
+        self.stats['encoding_fixed'] += len(found)
+        return self.encoding_pattern.sub(lambda match: self.encoding_fixes[match.group()], text)
+    
+    def fix_encoding_column(self, series):
+        """Corrige encoding de una columna procesando cada valor distinto una sola vez"""
+        fixed_values = {}
+        for value, count in series.value_counts(dropna=False).items():
+            before = self.stats['encoding_fixed']
+            fixed_values[value] = self.fix_utf8_encoding(value)
+            # Mantiene el conteo como si se hubiera corregido fila por fila
+            self.stats['encoding_fixed'] += (self.stats['encoding_fixed'] - before) * (count - 1)
+        
+        return series.map(fixed_values)
     
     def fix_json_format(self, json_text):
         """Convierte JSON con comillas simples a formato válido - versión robusta"""
@@ -80,7 +156,7 @@ class SampleCleaner:
         
         try:
             # Intenta parsear primero (por si ya está bien)
-            json.loads(json_text)
+            json_loads(json_text)
             return json_text
         except:
             pass
@@ -92,14 +168,14 @@ class SampleCleaner:
         fixed = fixed.replace('\\', '')
         
         # Corrige comillas simples por dobles en propiedades
-        fixed = re.sub(r"'(\w+)':", r'"\1":', fixed)
+        fixed = JSON_SINGLE_QUOTED_KEY.sub(r'"\1":', fixed)
         
         # Corrige comillas simples por dobles en valores - más robusto
-        fixed = re.sub(r":\s*'([^']*?)'", r': "\1"', fixed)
+        fixed = JSON_SINGLE_QUOTED_VALUE.sub(r': "\1"', fixed)
         
         # Intenta parsear la versión corregida
         try:
-            json.loads(fixed)
+            json_loads(fixed)
             self.stats['json_fixed'] += 1
             return fixed
         except Exception as e:
@@ -123,7 +199,7 @@ class SampleCleaner:
                 return {}
             
             # Parsea JSON
-            answers_list = json.loads(fixed_json)
+            answers_list = json_loads(fixed_json)
             
             if not isinstance(answers_list, list):
                 return {}
@@ -137,18 +213,10 @@ class SampleCleaner:
                         sub_id = answer.get('subQuestionId', '')
                         answer_value = self.fix_utf8_encoding(str(answer.get('answerValue', '')))
                         
-                        # Mapeo específico por tipo de métrica
-                        if sub_id == 'nps_rate_recomendation':
-                            result['nps_recomendacion_score'] = answer_value
-                        elif sub_id == 'nps_text_recomendation':
-                            result['nps_recomendacion_motivo'] = answer_value
-                        elif sub_id == 'csat_rate_satisfied':
-                            result['csat_satisfaccion_score'] = answer_value
-                        elif sub_id == 'csat_text_satisfied':
-                            result['csat_satisfaccion_motivo'] = answer_value
-                        else:
-                            # Para otros tipos futuros, usar el subQuestionId como nombre
-                            result[f"metric_{sub_id}"] = answer_value
+                        # Mapeo específico por tipo de métrica; para otros tipos
+                        # futuros, usar el subQuestionId como nombre
+                        column = SUBQUESTION_COLUMNS.get(sub_id) or f"metric_{sub_id}"
+                        result[column] = answer_value
                     except Exception as inner_e:
                         # Si falla un elemento individual, continúa con los demás
                         self.logger.warning(f"Error procesando elemento JSON individual: {str(inner_e)}")
@@ -160,6 +228,39 @@ class SampleCleaner:
             self.logger.warning(f"Error parseando JSON completo, devolviendo vacío: {str(e)}")
             return {}
     
+    def parse_bm_answers_serial(self, answers_list):
+        """Parsea respuestas BM en el proceso actual"""
+        total = len(answers_list)
+        expanded_data = [None] * total
+        for idx, answers in enumerate(answers_list):
+            if idx % 100 == 0:
+                self.logger.info(f"  Procesado {idx}/{total}")
+            
+            expanded_data[idx] = self.parse_bm_answers(answers)
+        
+        return expanded_data
+    
+    def parse_bm_answers_parallel(self, answers_list):
+        """Parsea respuestas BM repartiendo la lista entre varios procesos"""
+        workers = os.cpu_count() or 1
+        if workers < 2:
+            # Con un solo núcleo el pool solo agregaría el costo de serializar los datos
+            return self.parse_bm_answers_serial(answers_list)
+        
+        chunk_size = -(-len(answers_list) // workers)
+        chunks = [answers_list[i:i + chunk_size] for i in range(0, len(answers_list), chunk_size)]
+        
+        expanded_data = []
+        with ProcessPoolExecutor(max_workers=workers) as executor:
+            for parsed, chunk_stats in executor.map(parse_answers_chunk, chunks):
+                expanded_data.extend(parsed)
+                # Acumula los contadores de cada proceso
+                for key, value in chunk_stats.items():
+                    self.stats[key] += value
+                self.logger.info(f"  Procesado {len(expanded_data)}/{len(answers_list)}")
+        
+        return expanded_data
+    
     def fix_timezone_for_excel(self, dt_series):
         """Remueve timezone para compatibilidad con Excel"""
         if dt_series is None:
@@ -174,20 +275,14 @@ class SampleCleaner:
         except:
             return dt_series
     
-    def categorize_nps(self, score):
-        """Categoriza score NPS"""
-        if pd.isna(score):
-            return 'Unknown'
-        try:
-            score = float(score)
-            if score <= 6:
-                return 'Detractor'
-            elif score <= 8:
-                return 'Neutral'
-            else:
-                return 'Promotor'
-        except:
-            return 'Unknown'
+    def categorize_nps_series(self, scores):
+        """Categoriza una serie numérica de scores NPS de forma vectorizada"""
+        categories = np.select(
+            [scores.isna(), scores <= 6, scores <= 8],
+            ['Unknown', 'Detractor', 'Neutral'],
+            default='Promotor'
+        )
+        return pd.Series(categories, index=scores.index, dtype=object)
     
     def clean_bm_sample(self, df):
         """Limpia muestra de BM (Banco Móvil)"""
@@ -199,7 +294,7 @@ class SampleCleaner:
         text_columns = cleaned.select_dtypes(include=['object']).columns
         for col in text_columns:
             if col != 'answers':  # answers se procesa especialmente
-                cleaned[col] = cleaned[col].astype(str).apply(self.fix_utf8_encoding)
+                cleaned[col] = self.fix_encoding_column(cleaned[col].astype(str))
         
         # Procesa fechas
         date_columns = ['timestamp', 'answerDate']
@@ -212,28 +307,25 @@ class SampleCleaner:
         if 'answers' in cleaned.columns:
             self.logger.info("Expandiendo JSON de respuestas...")
             
-            expanded_data = []
-            for idx, answers in enumerate(cleaned['answers']):
-                if idx % 100 == 0:
-                    self.logger.info(f"  Procesado {idx}/{len(cleaned)}")
-                
-                parsed = self.parse_bm_answers(answers)
-                expanded_data.append(parsed)
+            if len(cleaned) >= PARALLEL_MIN_ROWS:
+                expanded_data = self.parse_bm_answers_parallel(cleaned['answers'].tolist())
+            else:
+                expanded_data = self.parse_bm_answers_serial(cleaned['answers'].tolist())
             
-            # Combina datos expandidos
-            expanded_df = pd.DataFrame(expanded_data)
+            # Combina datos expandidos (alineados al índice de la muestra)
+            expanded_df = pd.DataFrame.from_records(expanded_data, index=cleaned.index)
             cleaned = pd.concat([cleaned, expanded_df], axis=1)
         
         # Procesa NPS usando las columnas limpias
         if 'nps_recomendacion_score' in cleaned.columns:
             cleaned['nps_score'] = pd.to_numeric(cleaned['nps_recomendacion_score'], errors='coerce')
             cleaned['nps_score'] = cleaned['nps_score'].clip(0, 10)
-            cleaned['nps_category'] = cleaned['nps_score'].apply(self.categorize_nps)
+            cleaned['nps_category'] = self.categorize_nps_series(cleaned['nps_score'])
         elif 'nps_score_original' in cleaned.columns:
             # Fallback al NPS original si no hay expandido
             cleaned['nps_score'] = pd.to_numeric(cleaned['nps_score_original'], errors='coerce')
             cleaned['nps_score'] = cleaned['nps_score'].clip(0, 10)
-            cleaned['nps_category'] = cleaned['nps_score'].apply(self.categorize_nps)
+            cleaned['nps_category'] = self.categorize_nps_series(cleaned['nps_score'])
         
         # Agrega metadatos
         cleaned['cleaned_date'] = datetime.now()
@@ -254,7 +346,20 @@ class SampleCleaner:
         # Corrige encoding en todas las columnas de texto
         text_columns = cleaned.select_dtypes(include=['object']).columns
         for col in text_columns:
-            cleaned[col] = cleaned[col].astype(str).apply(self.fix_utf8_encoding)
+            cleaned[col] = self.fix_encoding_column(cleaned[col].astype(str))
+        
+        # Clasifica columnas en una sola pasada: NPS, URLs y feedback
+        nps_col = None
+        url_columns = []
+        feedback_columns = []
+        for col in cleaned.columns:
+            col_lower = col.lower()
+            if nps_col is None and 'recomien' in col_lower and 'probable' in col_lower:
+                nps_col = col
+            if 'URL' in col or 'url' in col_lower:
+                url_columns.append(col)
+            if 'motiv' in col_lower or 'calific' in col_lower:
+                feedback_columns.append(col)
         
         # Procesa fechas
         if 'Date Submitted' in cleaned.columns:
@@ -262,43 +367,25 @@ class SampleCleaner:
             cleaned['date_submitted'] = self.fix_timezone_for_excel(cleaned['date_submitted'])
             cleaned['month_year'] = cleaned['date_submitted'].dt.strftime('%Y-%m')
         
-        # Encuentra y procesa columna NPS
-        nps_col = None
-        for col in cleaned.columns:
-            if 'recomien' in col.lower() and 'probable' in col.lower():
-                nps_col = col
-                break
-        
+        # Procesa columna NPS
         if nps_col:
             cleaned['nps_score'] = pd.to_numeric(cleaned[nps_col], errors='coerce')
             cleaned['nps_score'] = cleaned['nps_score'].clip(0, 10)
-            cleaned['nps_category'] = cleaned['nps_score'].apply(self.categorize_nps)
+            cleaned['nps_category'] = self.categorize_nps_series(cleaned['nps_score'])
         
         # Normaliza URLs
-        url_columns = [col for col in cleaned.columns if 'URL' in col or 'url' in col.lower()]
         for col in url_columns:
-            if col in cleaned.columns:
-                cleaned[col] = cleaned[col].apply(self.clean_url)
+            cleaned[col] = self.clean_url_column(cleaned[col])
         
         # Limpia comentarios de feedback
-        feedback_columns = [col for col in cleaned.columns if 'motiv' in col.lower() or 'calific' in col.lower()]
         for col in feedback_columns:
-            if col in cleaned.columns:
-                cleaned[col] = cleaned[col].apply(self.clean_feedback_text)
+            cleaned[col] = self.clean_feedback_column(cleaned[col])
         
         # Elimina columnas redundantes y renombra para claridad
         columns_to_drop = ['Number', 'User', 'Hotjar User ID', 'Response URL']
-        for col in columns_to_drop:
-            if col in cleaned.columns:
-                cleaned = cleaned.drop(columns=[col])
+        cleaned = cleaned.drop(columns=[col for col in columns_to_drop if col in cleaned.columns])
         
         # Renombra columnas largas
-        nps_col = None
-        for col in cleaned.columns:
-            if 'recomien' in col.lower() and 'probable' in col.lower():
-                nps_col = col
-                break
-        
         if nps_col:
             cleaned = cleaned.rename(columns={
                 nps_col: 'nps_score_bv',
@@ -324,25 +411,32 @@ class SampleCleaner:
         
         return cleaned
     
-    def clean_url(self, url):
-        """Limpia URLs"""
-        if pd.isna(url) or not url or url == 'nan':
-            return ''
-        
-        url = str(url).strip()
-        if '?' in url:
-            return url.split('?')[0]
-        return url
+    def clean_url_column(self, series):
+        """Limpia una columna completa de URLs con operaciones vectorizadas"""
+        # Vacíos: nulos, '' y 'nan', y también valores falsos como 0 (no son URLs)
+        empty = series.isna() | series.isin(['', 'nan', 0])
+        urls = series.astype(str).str.strip().str.split('?', n=1).str[0]
+        return urls.mask(empty, '')
+    
+    def clean_feedback_column(self, series):
+        """Limpia una columna completa de feedback con operaciones vectorizadas"""
+        # Vacíos: nulos, '' y 'nan', y también valores falsos como 0 (no son comentarios)
+        empty = series.isna() | series.isin(['', 'nan', 0])
+        texts = series.astype(str).str.strip().str.replace(FEEDBACK_INVALID_CHARS, '', regex=True)
+        return texts.mask(empty, '')
     
-    def clean_feedback_text(self, text):
-        """Limpia texto de feedback"""
-        if pd.isna(text) or not text or text == 'nan':
-            return ''
-        
-        text = str(text).strip()
-        # Remueve caracteres extraños pero mantiene tildes y ñ
-        text = re.sub(r'[^\w\s\.\,\!\?\:\;\-\ñáéíóúÁÉÍÓÚ]', '', text)
-        return text
+    def read_sample(self, file_path):
+        """Lee una muestra; usa la copia Parquet del extractor solo si está al día"""
+        file_path = Path(file_path)
+        parquet_file = file_path.with_suffix('.parquet')
+        if (PARQUET_AVAILABLE and parquet_file.exists()
+                and parquet_file.stat().st_mtime >= file_path.stat().st_mtime):
+            try:
+                return pd.read_parquet(parquet_file)
+            except Exception as e:
+                self.logger.warning(f"No se pudo leer {parquet_file}, se usa el Excel: {str(e)}")
+        
+        return pd.read_excel(file_path, engine=EXCEL_ENGINE)
     
     def process_sample_file(self, file_path):
         """Procesa un archivo de muestra"""
@@ -350,16 +444,16 @@ class SampleCleaner:
         
         try:
             # Lee archivo
-            df = pd.read_excel(file_path)
+            df = self.read_sample(file_path)
             
             # Determina tipo por nombre de archivo
             file_name = Path(file_path).name.lower()
-            if 'bm' in file_name:
+            match = FILE_TYPE_PATTERN.search(file_name)
+            file_type = match.group(1).upper() if match else None
+            if file_type == 'BM':
                 cleaned_df = self.clean_bm_sample(df)
-                file_type = 'BM'
-            elif 'bv' in file_name:
+            elif file_type == 'BV':
                 cleaned_df = self.clean_bv_sample(df)
-                file_type = 'BV'
             else:
                 raise ValueError(f"No se pudo determinar tipo de archivo: {file_name}")
             
@@ -396,9 +490,10 @@ class SampleCleaner:
             nps_data = df['nps_score'].dropna()
             if len(nps_data) > 0:
                 self.logger.info(f"\nANALISIS NPS:")
+                nps_stats = nps_data.agg(['mean', 'min', 'max'])
                 self.logger.info(f"  Registros con NPS: {len(nps_data)}")
-                self.logger.info(f"  Promedio NPS: {nps_data.mean():.2f}")
-                self.logger.info(f"  Rango: {nps_data.min()} - {nps_data.max()}")
+                self.logger.info(f"  Promedio NPS: {nps_stats['mean']:.2f}")
+                self.logger.info(f"  Rango: {nps_stats['min']:g} - {nps_stats['max']:g}")
                 
                 if 'nps_category' in df.columns:
                     categories = df['nps_category'].value_counts()
@@ -441,6 +536,12 @@ class SampleCleaner:
         
         return True
 
+def parse_answers_chunk(answers_chunk):
+    """Parsea un bloque de respuestas BM en un proceso hijo"""
+    cleaner = SampleCleaner(configure_logging=False)
+    parsed = [cleaner.parse_bm_answers(answers) for answers in answers_chunk]
+    return parsed, cleaner.stats
+
 def main():
     """Función principal"""
     print("🚀 LIMPIEZA DE MUESTRAS NPS")
@@ -473,28 +574,31 @@ def main():
         if clean_file and clean_df is not None:
             # Analiza calidad
             cleaner.analyze_cleaned_sample(clean_df, file_type)
-            results.append((sample_file, clean_file, len(clean_df), file_type))
+            results.append((sample_file.name, clean_file.name, len(clean_df), file_type))
     
-    # Resumen final
-    print(f"\n{'='*50}")
-    print("📊 RESUMEN DE LIMPIEZA DE MUESTRAS:")
+    # Resumen final (se arma completo y se imprime de una vez)
+    summary = [f"\n{'='*50}", "📊 RESUMEN DE LIMPIEZA DE MUESTRAS:"]
     
     if results:
-        for original, cleaned, size, ftype in results:
-            print(f"✅ {ftype}: {original.name} → {cleaned.name} ({size:,} registros)")
+        for original_name, clean_name, size, ftype in results:
+            summary.append(f"✅ {ftype}: {original_name} → {clean_name} ({size:,} registros)")
         
-        print(f"\n📈 ESTADÍSTICAS:")
+        summary.append(f"\n📈 ESTADÍSTICAS:")
         for key, value in cleaner.stats.items():
-            print(f"  {key}: {value:,}")
+            summary.append(f"  {key}: {value:,}")
         
-        print(f"\n🎯 SIGUIENTE PASO:")
-        print("1. Revisar archivos en carpeta 'muestras_limpias/'")
-        print("2. Insertar muestras limpias en PostgreSQL")
-        print("3. Validar resultados en base de datos")
-        print("4. Si todo está correcto, procesar archivos completos")
+        summary.extend([
+            f"\n🎯 SIGUIENTE PASO:",
+            "1. Revisar archivos en carpeta 'muestras_limpias/'",
+            "2. Insertar muestras limpias en PostgreSQL",
+            "3. Validar resultados en base de datos",
+            "4. Si todo está correcto, procesar archivos completos"
+        ])
         
     else:
-        print("❌ No se procesaron muestras exitosamente")
+        summary.append("❌ No se procesaron muestras exitosamente")
+    
+    print("\n".join(summary))
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
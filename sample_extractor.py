@@ -6,8 +6,40 @@ Toma 1000 registros de cada archivo para testing
 
 import pandas as pd
 import os
+import io
+import argparse
+from functools import partial
+from contextlib import redirect_stdout
+from concurrent.futures import ProcessPoolExecutor
 from pathlib import Path
 import random
+import re
+
+# Columnas importantes para la vista previa de la muestra
+IMPORTANT_COLUMNS = re.compile(r'answer|nps|score|timestamp|date', re.IGNORECASE)
+
+# Motor de lectura Excel: calamine (Rust) si está instalado y pandas lo soporta
+# (engine='calamine' existe desde pandas 2.2); si no, el de pandas por defecto
+try:
+    import python_calamine  # noqa: F401
+    PANDAS_VERSION = tuple(int(part) for part in pd.__version__.split('.')[:2])
+    EXCEL_ENGINE = 'calamine' if PANDAS_VERSION >= (2, 2) else None
+except ImportError:
+    EXCEL_ENGINE = None
+
+# Motor de escritura Excel: xlsxwriter escribe en streaming y usa menos memoria que openpyxl
+try:
+    import xlsxwriter  # noqa: F401
+    EXCEL_WRITER_ENGINE = 'xlsxwriter'
+except ImportError:
+    EXCEL_WRITER_ENGINE = None
+
+# Con pyarrow se guarda además una copia Parquet, mucho más rápida de releer
+try:
+    import pyarrow  # noqa: F401
+    PARQUET_AVAILABLE = True
+except ImportError:
+    PARQUET_AVAILABLE = False
 
 def extract_sample(file_path, sample_size=300000, output_dir="muestras"):
     """
@@ -17,17 +49,17 @@ def extract_sample(file_path, sample_size=300000, output_dir="muestras"):
         file_path: Ruta al archivo Excel
         sample_size: Número de registros a extraer
         output_dir: Carpeta donde guardar muestras
+    
+    Returns:
+        (archivo de muestra, registros en muestra, DataFrame de la muestra)
     """
     
     print(f"📂 Procesando: {file_path}")
     
     try:
-        # Lee información básica del archivo
-        df_info = pd.read_excel(file_path, nrows=1)
-        
         # Lee archivo completo para obtener total de filas
         print("📊 Leyendo archivo completo para contar registros...")
-        df_full = pd.read_excel(file_path)
+        df_full = pd.read_excel(file_path, engine=EXCEL_ENGINE)
         total_rows = len(df_full)
         
         print(f"📈 Total de registros en archivo: {total_rows:,}")
@@ -40,18 +72,31 @@ def extract_sample(file_path, sample_size=300000, output_dir="muestras"):
         else:
             print(f"🎲 Extrayendo muestra aleatoria de {sample_size} registros...")
             sample_df = df_full.sample(n=sample_size, random_state=42)
+        sample_rows = len(sample_df)
         
         # Crear directorio de salida
-        Path(output_dir).mkdir(exist_ok=True)
+        output_path = Path(output_dir)
+        output_path.mkdir(exist_ok=True)
         
         # Generar nombre de archivo de muestra
         base_name = Path(file_path).stem
-        sample_file = Path(output_dir) / f"{base_name}_muestra_{len(sample_df)}.xlsx"
+        sample_file = output_path / f"{base_name}_muestra_{sample_rows}.xlsx"
         
         # Guardar muestra
-        sample_df.to_excel(sample_file, index=False)
+        sample_df.to_excel(sample_file, index=False, engine=EXCEL_WRITER_ENGINE)
         print(f"✅ Muestra guardada: {sample_file}")
-        print(f"📊 Registros en muestra: {len(sample_df):,}")
+        
+        # Una copia Parquet de una corrida anterior nunca debe quedar junto al Excel nuevo
+        parquet_file = sample_file.with_suffix('.parquet')
+        parquet_file.unlink(missing_ok=True)
+        if PARQUET_AVAILABLE:
+            try:
+                sample_df.to_parquet(parquet_file, compression='zstd', index=False)
+                print(f"✅ Copia Parquet guardada: {parquet_file}")
+            except Exception as e:
+                parquet_file.unlink(missing_ok=True)
+                print(f"⚠️  No se pudo guardar copia Parquet: {str(e)}")
+        print(f"📊 Registros en muestra: {sample_rows:,}")
         
         # Mostrar información de la muestra
         print("\n📋 INFORMACIÓN DE LA MUESTRA:")
@@ -59,51 +104,57 @@ def extract_sample(file_path, sample_size=300000, output_dir="muestras"):
         print("\nPrimeras 3 filas de columnas importantes:")
         
         # Mostrar columnas relevantes
-        important_cols = []
-        for col in sample_df.columns:
-            if any(keyword in col.lower() for keyword in ['answer', 'nps', 'score', 'timestamp', 'date']):
-                important_cols.append(col)
+        important_cols = [col for col in sample_df.columns if IMPORTANT_COLUMNS.search(col)]
         
         if important_cols:
             print(sample_df[important_cols].head(3))
         else:
             print(sample_df.head(3))
         
-        return sample_file, len(sample_df)
+        return sample_file, sample_rows, sample_df
         
     except Exception as e:
         print(f"❌ Error procesando {file_path}: {str(e)}")
-        return None, 0
+        return None, 0, None
 
-def analyze_sample_data(sample_file):
-    """Analiza la muestra extraída"""
+def analyze_sample_data(sample_file, df=None):
+    """Analiza la muestra extraída (usa df si ya está en memoria)"""
     print(f"\n🔍 ANÁLISIS DETALLADO: {sample_file}")
     print("=" * 60)
     
     try:
-        df = pd.read_excel(sample_file)
+        if df is None:
+            df = pd.read_excel(sample_file, engine=EXCEL_ENGINE)
         
         print(f"📊 Total registros: {len(df):,}")
         print(f"📊 Total columnas: {len(df.columns)}")
         
         print("\n📋 COLUMNAS DISPONIBLES:")
-        for i, col in enumerate(df.columns):
-            print(f"  {i+1:2d}. {col}")
+        print("\n".join(f"  {i:2d}. {col}" for i, col in enumerate(df.columns, 1)))
         
         # Analizar columna answers si existe
         if 'answers' in df.columns:
             print("\n🔍 ANÁLISIS COLUMNA 'answers':")
-            answers_sample = df['answers'].dropna().head(3)
-            for i, answer in enumerate(answers_sample):
+            answers = df['answers'].dropna()
+            
+            # Detecta problemas en toda la columna de una vez
+            answers_text = answers.astype(str)
+            has_bad_encoding = answers_text.str.contains('Ã', regex=False)
+            single_quoted = answers_text.str.startswith("[{'")
+            print(f"  Con encoding UTF-8 dañado: {has_bad_encoding.sum():,} de {len(answers):,}")
+            print(f"  JSON con comillas simples: {single_quoted.sum():,} de {len(answers):,}")
+            
+            for i in range(min(3, len(answers))):
+                answer = answers.iloc[i]
                 print(f"\nEjemplo {i+1}:")
                 print(f"  Tipo: {type(answer)}")
                 print(f"  Contenido: {str(answer)[:150]}...")
                 
                 # Intentar detectar problemas
                 if isinstance(answer, str):
-                    if 'Ã' in answer:
+                    if has_bad_encoding.iloc[i]:
                         print("  ⚠️  PROBLEMA: Encoding UTF-8 detectado")
-                    if answer.startswith("[{'"):
+                    if single_quoted.iloc[i]:
                         print("  ⚠️  PROBLEMA: JSON con comillas simples")
                     if answer.startswith('[{"'):
                         print("  ✅ JSON parece correcto")
@@ -112,10 +163,17 @@ def analyze_sample_data(sample_file):
         nps_columns = [col for col in df.columns if 'nps' in col.lower() or 'recomien' in col.lower()]
         if nps_columns:
             print(f"\n📈 COLUMNAS NPS ENCONTRADAS: {nps_columns}")
-            for col in nps_columns:
-                values = df[col].dropna()
-                if len(values) > 0:
-                    print(f"  {col}: min={values.min()}, max={values.max()}, promedio={values.mean():.1f}")
+            # Estadísticas de las columnas NPS numéricas en una sola agregación
+            # (BV trae columnas de texto como 'Tags for: ¿Qué tan probable es que recomiendes…')
+            numeric_nps = df[nps_columns].select_dtypes('number')
+            if len(numeric_nps.columns) > 0:
+                nps_stats = numeric_nps.agg(['count', 'min', 'max', 'mean'])
+                lines = [
+                    f"  {col}: min={nps_stats.at['min', col]:g}, max={nps_stats.at['max', col]:g}, promedio={nps_stats.at['mean', col]:.1f}"
+                    for col in nps_stats.columns if nps_stats.at['count', col] > 0
+                ]
+                if lines:
+                    print("\n".join(lines))
         
         # Buscar columnas de fecha
         date_columns = [col for col in df.columns if any(word in col.lower() for word in ['date', 'time', 'fecha'])]
@@ -128,8 +186,25 @@ def analyze_sample_data(sample_file):
         print(f"❌ Error analizando muestra: {str(e)}")
         return False
 
+def process_file(file_path, analyze=False):
+    """Extrae (y opcionalmente analiza) un archivo en un proceso aparte; devuelve el reporte impreso"""
+    report = io.StringIO()
+    with redirect_stdout(report):
+        print(f"\n📁 Procesando: {file_path}")
+        sample_file, sample_size, sample_df = extract_sample(file_path, sample_size=999999)
+        
+        if sample_file and analyze:
+            # Analizar muestra sin volver a leer el Excel recién escrito
+            analyze_sample_data(sample_file, df=sample_df)
+    
+    return file_path, sample_file, sample_size, report.getvalue()
+
 def main():
     """Función principal"""
+    parser = argparse.ArgumentParser(description="Extrae muestras de los archivos Excel NPS")
+    parser.add_argument('--analyze', action='store_true', help="Muestra el análisis detallado de cada muestra")
+    args = parser.parse_args()
+    
     print("🚀 EXTRACTOR DE MUESTRAS - DATOS REALES NPS")
     print("=" * 50)
     
@@ -140,25 +215,27 @@ def main():
     ]
     
     results = []
+    existing_files = []
     
     for file_path in files_to_process:
         if os.path.exists(file_path):
-            print(f"\n📁 Procesando: {file_path}")
-            sample_file, sample_size = extract_sample(file_path, sample_size=999999)
-            
-            if sample_file:
-                results.append((file_path, sample_file, sample_size))
-                
-                # Analizar muestra
-                analyze_sample_data(sample_file)
-            
+            existing_files.append(file_path)
         else:
             print(f"❌ Archivo no encontrado: {file_path}")
             print(f"📂 Directorio actual: {os.getcwd()}")
             print("📋 Archivos en directorio:")
-            for f in os.listdir("."):
-                if f.endswith(('.xlsx', '.xls')):
-                    print(f"   - {f}")
+            with os.scandir(".") as entries:
+                for entry in entries:
+                    if entry.is_file() and entry.name.endswith(('.xlsx', '.xls')):
+                        print(f"   - {entry.name}")
+    
+    # Cada archivo se lee y muestrea en su propio proceso (la lectura de Excel es CPU)
+    if existing_files:
+        with ProcessPoolExecutor(max_workers=len(existing_files)) as executor:
+            for file_path, sample_file, sample_size, report in executor.map(partial(process_file, analyze=args.analyze), existing_files):
+                print(report, end='')
+                if sample_file:
+                    results.append((file_path, sample_file, sample_size))
     
     # Resumen final
     print(f"\n{'='*50}")
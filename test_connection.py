@@ -7,6 +7,7 @@ Test básico antes de procesar 300k registros
 import pandas as pd
 import psycopg2
 from sqlalchemy import create_engine
+from sqlalchemy.engine import URL
 import json
 import re
 from datetime import datetime
@@ -56,8 +57,14 @@ def test_sqlalchemy():
     
     try:
         engine = create_engine(
-            f"postgresql://{DB_CONFIG['username']}:{DB_CONFIG['password']}"
-            f"@{DB_CONFIG['host']}:{DB_CONFIG['port']}/{DB_CONFIG['database']}"
+            URL.create(
+                'postgresql',
+                username=DB_CONFIG['username'],
+                password=DB_CONFIG['password'],
+                host=DB_CONFIG['host'],
+                port=int(DB_CONFIG['port']),
+                database=DB_CONFIG['database']
+            )
         )
         
         # Test query con pandas
@@ -147,22 +154,20 @@ def test_data_insertion(engine):
         )
         print("✅ Datos insertados exitosamente!")
         
-        # Verifica inserción
-        verify_df = pd.read_sql("SELECT * FROM test_nps_data", engine)
-        print(f"📊 Verificación: {len(verify_df)} registros en BD")
-        
-        # Calcula NPS
+        # Calcula NPS (la misma consulta sirve para verificar la inserción)
         nps_calc = pd.read_sql("""
             SELECT 
                 channel,
                 AVG(nps_score) as avg_nps,
                 COUNT(*) as total,
-                COUNT(CASE WHEN nps_score >= 9 THEN 1 END) as promoters,
-                COUNT(CASE WHEN nps_score <= 6 THEN 1 END) as detractors
+                COUNT(*) FILTER (WHERE nps_score >= 9) as promoters,
+                COUNT(*) FILTER (WHERE nps_score <= 6) as detractors
             FROM test_nps_data 
             GROUP BY channel
         """, engine)
         
+        print(f"📊 Verificación: {nps_calc['total'].sum()} registros en BD")
+        
         print("\n📈 Análisis NPS por canal:")
         print(nps_calc)
         